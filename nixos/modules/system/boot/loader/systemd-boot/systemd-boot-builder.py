@@ -5,7 +5,6 @@ import os
 import sys
 import errno
 import subprocess
-import glob
 import tempfile
 import errno
 import warnings
@@ -13,12 +12,82 @@ import ctypes
 libc = ctypes.CDLL("libc.so.6")
 import re
 import datetime
-import glob
 import os.path
+import functools
+import collections
+import concurrent.futures
+import threading
+import signal
+
+LOADER_DIR = "@efiSysMountPoint@/loader"
+ENTRIES_DIR = "@efiSysMountPoint@/loader/entries"
+NIXOS_DIR = "@efiSysMountPoint@/efi/nixos"
+
+# Entries are written concurrently, and several generations may share the
+# same kernel or initrd on the ESP, so serialise work on any given path.
+path_locks = collections.defaultdict(threading.Lock)
+path_locks_lock = threading.Lock()
+
+def path_lock(path):
+    with path_locks_lock:
+        return path_locks[path]
+
+# Set by main(): whether files are synced one by one as they are written,
+# instead of syncing the whole ESP with syncfs() at the end.
+sync_each_file = False
+
+def sync_file(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fdatasync(fd)
+    finally:
+        os.close(fd)
+
+def copy_contents(source, dest):
+    with open(source, 'rb') as src, open(dest, 'wb') as dst:
+        os.posix_fadvise(src.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        # Let the kernel move the data where it can; kernels and initrds are
+        # large.
+        try:
+            remaining = os.fstat(src.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+        else:
+            return
+    # copy_file_range() does not work between these filesystems (e.g. store
+    # on ext4, ESP on vfat), but shutil still copies in the kernel using
+    # sendfile().
+    shutil.copyfile(source, dest)
+
+def copy_file(source, dest, append_initrd_secrets=None):
+    # Only move the copy into place once it is complete, so a full ESP or a
+    # crash never leaves a truncated kernel or initrd behind that later runs
+    # would take for a good one.
+    tmp_path = "%s.tmp" % dest
+    try:
+        copy_contents(source, tmp_path)
+        if append_initrd_secrets is not None:
+            subprocess.check_call([append_initrd_secrets, tmp_path])
+        if sync_each_file:
+            sync_file(tmp_path)
+        os.replace(tmp_path, dest)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
 
 def copy_if_not_exists(source, dest):
-    if not os.path.exists(dest):
-        shutil.copyfile(source, dest)
+    with path_lock(dest):
+        if not os.path.exists(dest):
+            copy_file(source, dest)
 
 def system_dir(profile, generation):
     if profile:
@@ -26,7 +95,9 @@ def system_dir(profile, generation):
     else:
         return "/nix/var/nix/profiles/system-%d-link" % (generation)
 
-BOOT_ENTRY = """title NixOS{profile}
+def boot_entry(profile, generation, kernel, initrd, kernel_params, description):
+    profile = " [%s]" % profile if profile else ""
+    return f"""title NixOS{profile}
 version Generation {generation} {description}
 linux {kernel}
 initrd {initrd}
@@ -42,27 +113,54 @@ MEMTEST_BOOT_ENTRY = """title MemTest86
 efi /efi/memtest86/BOOTX64.efi
 """
 
-def write_loader_conf(profile, generation):
-    with open("@efiSysMountPoint@/loader/loader.conf.tmp", 'w') as f:
-        if "@timeout@" != "":
-            f.write("timeout @timeout@\n")
-        if profile:
-            f.write("default nixos-%s-generation-%d.conf\n" % (profile, generation))
-        else:
-            f.write("default nixos-generation-%d.conf\n" % (generation))
-        if not @editor@:
-            f.write("editor 0\n");
-        f.write("console-mode @consoleMode@\n");
-    os.rename("@efiSysMountPoint@/loader/loader.conf.tmp", "@efiSysMountPoint@/loader/loader.conf")
-
+def generation_conf_filename(profile, generation):
+    if profile:
+        return "nixos-%s-generation-%d.conf" % (profile, generation)
+    else:
+        return "nixos-generation-%d.conf" % (generation)
+
+def write_file(dir_fd, name, contents):
+    # Write the whole file in one go and only then move it into place, so
+    # the ESP never sees a partially written file.
+    tmp_name = "%s.tmp" % name
+    data = contents.encode("utf-8")
+    fd = os.open(tmp_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644, dir_fd=dir_fd)
+    try:
+        written = 0
+        while written < len(data):
+            written += os.write(fd, data[written:])
+        if sync_each_file:
+            os.fdatasync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp_name, name, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+
+def write_loader_conf(profile, generation, loader_fd):
+    lines = []
+    if "@timeout@" != "":
+        lines.append("timeout @timeout@\n")
+    lines.append("default %s\n" % generation_conf_filename(profile, generation))
+    if not @editor@:
+        lines.append("editor 0\n");
+    lines.append("console-mode @consoleMode@\n");
+    write_file(loader_fd, "loader.conf", "".join(lines))
+
+# Both remove_old_entries() and write_entry() resolve the same profile links
+# for every generation, so only hit the filesystem once per link.
+@functools.lru_cache(maxsize=None)
 def profile_path(profile, generation, name):
     return os.readlink("%s/%s" % (system_dir(profile, generation), name))
 
-def copy_from_profile(profile, generation, name, dry_run=False):
+@functools.lru_cache(maxsize=None)
+def efi_file_paths(profile, generation, name):
     store_file_path = profile_path(profile, generation, name)
     suffix = os.path.basename(store_file_path)
     store_dir = os.path.basename(os.path.dirname(store_file_path))
     efi_file_path = "/efi/nixos/%s-%s.efi" % (store_dir, suffix)
+    return store_file_path, efi_file_path
+
+def copy_from_profile(profile, generation, name, dry_run=False):
+    store_file_path, efi_file_path = efi_file_paths(profile, generation, name)
     if not dry_run:
         copy_if_not_exists(store_file_path, "@efiSysMountPoint@%s" % (efi_file_path))
     return efi_file_path
@@ -75,8 +173,8 @@ def describe_generation(generation_dir):
         nixos_version = "Unknown"
 
     kernel_dir = os.path.dirname(os.path.realpath("%s/kernel" % generation_dir))
-    module_dir = glob.glob("%s/lib/modules/*" % kernel_dir)[0]
-    kernel_version = os.path.basename(module_dir)
+    with os.scandir("%s/lib/modules" % kernel_dir) as it:
+        kernel_version = next(entry.name for entry in it if not entry.name.startswith("."))
 
     build_time = int(os.path.getctime(generation_dir))
     build_date = datetime.datetime.fromtimestamp(build_time).strftime('%F')
@@ -87,34 +185,29 @@ def describe_generation(generation_dir):
 
     return description
 
-def write_entry(profile, generation, machine_id):
+def write_entry(profile, generation, machine_id, entries_fd):
     kernel = copy_from_profile(profile, generation, "kernel")
-    initrd = copy_from_profile(profile, generation, "initrd")
     try:
         append_initrd_secrets = profile_path(profile, generation, "append-initrd-secrets")
-        subprocess.check_call([append_initrd_secrets, "@efiSysMountPoint@%s" % (initrd)])
     except FileNotFoundError:
-        pass
-    if profile:
-        entry_file = "@efiSysMountPoint@/loader/entries/nixos-%s-generation-%d.conf" % (profile, generation)
+        append_initrd_secrets = None
+    if append_initrd_secrets is None:
+        initrd = copy_from_profile(profile, generation, "initrd")
     else:
-        entry_file = "@efiSysMountPoint@/loader/entries/nixos-generation-%d.conf" % (generation)
+        # The secrets are appended to the copy on the ESP, so start from a
+        # fresh copy instead of appending to the one from the last run.
+        store_initrd, initrd = efi_file_paths(profile, generation, "initrd")
+        with path_lock("@efiSysMountPoint@%s" % (initrd)):
+            copy_file(store_initrd, "@efiSysMountPoint@%s" % (initrd), append_initrd_secrets)
     generation_dir = os.readlink(system_dir(profile, generation))
-    tmp_path = "%s.tmp" % (entry_file)
-    kernel_params = "init=%s/init " % generation_dir
-
     with open("%s/kernel-params" % (generation_dir)) as params_file:
-        kernel_params = kernel_params + params_file.read()
-    with open(tmp_path, 'w') as f:
-        f.write(BOOT_ENTRY.format(profile=" [" + profile + "]" if profile else "",
-                    generation=generation,
-                    kernel=kernel,
-                    initrd=initrd,
-                    kernel_params=kernel_params,
-                    description=describe_generation(generation_dir)))
-        if machine_id is not None:
-            f.write("machine-id %s\n" % machine_id)
-    os.rename(tmp_path, entry_file)
+        # Skip empty parameters so there is no trailing space after init=.
+        kernel_params = " ".join(filter(None, ("init=%s/init" % generation_dir, params_file.read().strip())))
+    entry = boot_entry(profile, generation, kernel, initrd, kernel_params,
+                       describe_generation(generation_dir))
+    if machine_id is not None:
+        entry += f"machine-id {machine_id}\n"
+    write_file(entries_fd, generation_conf_filename(profile, generation), entry)
 
 def mkdir_p(path):
     try:
@@ -124,40 +217,53 @@ def mkdir_p(path):
             raise
 
 def get_generations(profile=None):
-    gen_list = subprocess.check_output([
-        "@nix@/bin/nix-env",
-        "--list-generations",
-        "-p",
-        "/nix/var/nix/profiles/%s" % ("system-profiles/" + profile if profile else "system"),
-        "--option", "build-users-group", ""],
-        universal_newlines=True)
-    gen_lines = gen_list.split('\n')
-    gen_lines.pop()
+    # Generations are the <profile>-<N>-link symlinks next to the profile,
+    # which is all "nix-env --list-generations" would look at as well.
+    if profile:
+        profiles_dir = "/nix/var/nix/profiles/system-profiles"
+        rex_link = re.compile(r"%s-([0-9]+)-link" % re.escape(profile))
+    else:
+        profiles_dir = "/nix/var/nix/profiles"
+        rex_link = re.compile(r"system-([0-9]+)-link")
+    generations = []
+    with os.scandir(profiles_dir) as it:
+        for entry in it:
+            m = rex_link.fullmatch(entry.name)
+            if m is not None:
+                generations.append(int(m.group(1)))
+    generations.sort()
 
     configurationLimit = @configurationLimit@
-    return [ (profile, int(line.split()[0])) for line in gen_lines ][-configurationLimit:]
+    return [ (profile, generation) for generation in generations ][-configurationLimit:]
+
+# Matches the entry files written by write_entry(), capturing the profile
+# (None for the system profile) and the generation number.
+ENTRY_FILE_RE = re.compile(r"nixos(?:-(.*))?-generation-([1-9][0-9]*)\.conf")
 
 def remove_old_entries(gens):
-    rex_profile = re.compile("^@efiSysMountPoint@/loader/entries/nixos-(.*)-generation-.*\.conf$")
-    rex_generation = re.compile("^@efiSysMountPoint@/loader/entries/nixos.*-generation-(.*)\.conf$")
-    known_paths = []
+    known_gens = set(gens)
+    known_paths = set()
     for gen in gens:
-        known_paths.append(copy_from_profile(*gen, "kernel", True))
-        known_paths.append(copy_from_profile(*gen, "initrd", True))
-    for path in glob.iglob("@efiSysMountPoint@/loader/entries/nixos*-generation-[1-9]*.conf"):
-        try:
-            if rex_profile.match(path):
-                prof = rex_profile.sub(r"\1", path)
-            else:
-                prof = "system"
-            gen = int(rex_generation.sub(r"\1", path))
-            if not (prof, gen) in gens:
-                os.unlink(path)
-        except ValueError:
-            pass
-    for path in glob.iglob("@efiSysMountPoint@/efi/nixos/*"):
-        if not path in known_paths and not os.path.isdir(path):
-            os.unlink(path)
+        known_paths.add(copy_from_profile(*gen, "kernel", True))
+        known_paths.add(copy_from_profile(*gen, "initrd", True))
+    # The ESP is usually a slow FAT filesystem, so walk each directory once
+    # with scandir() and use the returned entries instead of stat'ing every
+    # path again.
+    with os.scandir(ENTRIES_DIR) as it:
+        for entry in it:
+            if not (entry.name.startswith("nixos") and entry.name.endswith(".conf")):
+                continue
+            m = ENTRY_FILE_RE.fullmatch(entry.name)
+            if m is None:
+                continue
+            if not (m.group(1), int(m.group(2))) in known_gens:
+                os.unlink(entry.path)
+    with os.scandir(NIXOS_DIR) as it:
+        for entry in it:
+            if entry.name.startswith("."):
+                continue
+            if not "/efi/nixos/%s" % entry.name in known_paths and not entry.is_dir(follow_symlinks=False):
+                os.unlink(entry.path)
 
 def get_profiles():
     if os.path.isdir("/nix/var/nix/profiles/system-profiles/"):
@@ -167,6 +273,92 @@ def get_profiles():
     else:
         return []
 
+# See status_binaries() in systemd bootctl.c for code which generates this
+SDBOOT_STATUS_RE = re.compile(r"^\W+File:.*/EFI/(BOOT|systemd)/.*\.efi \(systemd-boot (\d+)\)$", re.IGNORECASE)
+
+def parse_version(version):
+    # Compare versions numerically; as strings "99" would sort after "245".
+    return tuple(int(part) for part in re.split(r"[.\-]", version) if part.isdigit())
+
+# subprocess only uses posix_spawn() with close_fds=False, so by default it
+# fork()s, which has to copy the page tables of the whole builder. Use
+# posix_spawn() directly for the commands whose output we read. Like
+# subprocess, restore the signals Python ignores.
+def spawn(cmd):
+    read_fd, write_fd = os.pipe()
+    try:
+        pid = os.posix_spawn(cmd[0], cmd, os.environ,
+                             file_actions=[(os.POSIX_SPAWN_DUP2, write_fd, 1)],
+                             setsigdef=(signal.SIGPIPE, signal.SIGXFSZ))
+    except OSError:
+        os.close(read_fd)
+        raise
+    finally:
+        os.close(write_fd)
+    return pid, open(read_fd)
+
+def spawn_wait(pid):
+    _, status = os.waitpid(pid, 0)
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+def spawn_check_output(cmd):
+    pid, stdout = spawn(cmd)
+    read_all = False
+    try:
+        with stdout:
+            output = stdout.read()
+        read_all = True
+    finally:
+        # Always reap the child, even if reading its output failed.
+        if not read_all:
+            os.kill(pid, signal.SIGTERM)
+        returncode = spawn_wait(pid)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, output)
+    return output
+
+def get_installed_sdboot_version():
+    cmd = ["@systemd@/bin/bootctl", "--path=@efiSysMountPoint@", "status"]
+    version = None
+    pid, stdout = spawn(cmd)
+    read_all = False
+    try:
+        with stdout:
+            for line in stdout:
+                m = SDBOOT_STATUS_RE.match(line)
+                if m is not None:
+                    version = m.group(2)
+                    break
+            else:
+                read_all = True
+    finally:
+        # The rest of the output is of no interest, and the child has to be
+        # reaped even if reading its output failed.
+        if not read_all:
+            os.kill(pid, signal.SIGTERM)
+        returncode = spawn_wait(pid)
+    if version is None and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    return version
+
+def get_fs_type(path):
+    # The last mount covering path with the longest mount point is the one
+    # in effect.
+    path = os.path.realpath(path)
+    fs_type = None
+    mount_point_len = -1
+    with open("/proc/self/mounts") as f:
+        for line in f:
+            mount_point, mount_fs_type = line.split()[1:3]
+            mount_point = re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), mount_point)
+            if path == mount_point or path.startswith(mount_point.rstrip("/") + "/"):
+                if len(mount_point) >= mount_point_len:
+                    fs_type = mount_fs_type
+                    mount_point_len = len(mount_point)
+    return fs_type
+
 def main():
     parser = argparse.ArgumentParser(description='Update NixOS-related systemd-boot files')
     parser.add_argument('default_config', metavar='DEFAULT-CONFIG', help='The default NixOS config to boot')
@@ -174,7 +366,7 @@ def main():
 
     try:
         with open("/etc/machine-id") as machine_file:
-            machine_id = machine_file.readlines()[0]
+            machine_id = machine_file.readline().strip() or None
     except IOError as e:
         if e.errno != errno.ENOENT:
             raise
@@ -182,75 +374,98 @@ def main():
         # be there on newly installed systems, so let's generate one so that
         # bootctl can find it and we can also pass it to write_entry() later.
         cmd = ["@systemd@/bin/systemd-machine-id-setup", "--print"]
-        machine_id = subprocess.check_output(cmd).rstrip()
+        machine_id = subprocess.check_output(cmd, universal_newlines=True).rstrip()
 
     if os.getenv("NIXOS_INSTALL_GRUB") == "1":
         warnings.warn("NIXOS_INSTALL_GRUB env var deprecated, use NIXOS_INSTALL_BOOTLOADER", DeprecationWarning)
         os.environ["NIXOS_INSTALL_BOOTLOADER"] = "1"
 
+    bootctl_changed_esp = False
     if os.getenv("NIXOS_INSTALL_BOOTLOADER") == "1":
         # bootctl uses fopen() with modes "wxe" and fails if the file exists.
-        if os.path.exists("@efiSysMountPoint@/loader/loader.conf"):
-            os.unlink("@efiSysMountPoint@/loader/loader.conf")
+        if os.path.exists("%s/loader.conf" % LOADER_DIR):
+            os.unlink("%s/loader.conf" % LOADER_DIR)
 
         if "@canTouchEfiVariables@" == "1":
             subprocess.check_call(["@systemd@/bin/bootctl", "--path=@efiSysMountPoint@", "install"])
         else:
             subprocess.check_call(["@systemd@/bin/bootctl", "--path=@efiSysMountPoint@", "--no-variables", "install"])
+        bootctl_changed_esp = True
     else:
         # Update bootloader to latest if needed
-        systemd_version = subprocess.check_output(["@systemd@/bin/bootctl", "--version"], universal_newlines=True).split()[1]
-        sdboot_status = subprocess.check_output(["@systemd@/bin/bootctl", "--path=@efiSysMountPoint@", "status"], universal_newlines=True)
-
-        # See status_binaries() in systemd bootctl.c for code which generates this
-        m = re.search("^\W+File:.*/EFI/(BOOT|systemd)/.*\.efi \(systemd-boot (\d+)\)$",
-                      sdboot_status, re.IGNORECASE | re.MULTILINE)
-        if m is None:
+        systemd_version = spawn_check_output(["@systemd@/bin/bootctl", "--version"]).split()[1]
+        sdboot_version = get_installed_sdboot_version()
+        if sdboot_version is None:
             print("could not find any previously installed systemd-boot")
         else:
-            sdboot_version = m.group(2)
-            if systemd_version > sdboot_version:
+            if parse_version(systemd_version) > parse_version(sdboot_version):
                 print("updating systemd-boot from %s to %s" % (sdboot_version, systemd_version))
                 subprocess.check_call(["@systemd@/bin/bootctl", "--path=@efiSysMountPoint@", "update"])
+                bootctl_changed_esp = True
+
 
+    # Since fat32 provides little recovery facilities after a crash,
+    # it can leave the system in an unbootable state, when a crash/outage
+    # happens shortly after an update. To decrease the likelihood of this
+    # event sync the efi filesystem after each update. On journaling
+    # filesystems it is cheaper to sync just the files we write, unless
+    # bootctl changed files behind our back.
+    global sync_each_file
+    sync_each_file = not bootctl_changed_esp and get_fs_type("@efiSysMountPoint@") in ("ext3", "ext4", "btrfs", "xfs")
 
-    mkdir_p("@efiSysMountPoint@/efi/nixos")
-    mkdir_p("@efiSysMountPoint@/loader/entries")
+    mkdir_p(NIXOS_DIR)
+    mkdir_p(ENTRIES_DIR)
 
     gens = get_generations()
     for profile in get_profiles():
         gens += get_generations(profile)
     remove_old_entries(gens)
-    for gen in gens:
-        write_entry(*gen, machine_id)
-        if os.readlink(system_dir(*gen)) == args.default_config:
-            write_loader_conf(*gen)
-
-    memtest_entry_file = "@efiSysMountPoint@/loader/entries/memtest86.conf"
-    if os.path.exists(memtest_entry_file):
-        os.unlink(memtest_entry_file)
-    shutil.rmtree("@efiSysMountPoint@/efi/memtest86", ignore_errors=True)
-    if "@memtest86@" != "":
-        mkdir_p("@efiSysMountPoint@/efi/memtest86")
-        for path in glob.iglob("@memtest86@/*"):
-            if os.path.isdir(path):
-                shutil.copytree(path, os.path.join("@efiSysMountPoint@/efi/memtest86", os.path.basename(path)))
-            else:
-                shutil.copy(path, "@efiSysMountPoint@/efi/memtest86/")
-
-        memtest_entry_file = "@efiSysMountPoint@/loader/entries/memtest86.conf"
-        memtest_entry_file_tmp_path = "%s.tmp" % memtest_entry_file
-        with open(memtest_entry_file_tmp_path, 'w') as f:
-            f.write(MEMTEST_BOOT_ENTRY)
-        os.rename(memtest_entry_file_tmp_path, memtest_entry_file)
+    # Write everything below the loader directory relative to already open
+    # directories instead of resolving the full ESP path for every file.
+    entries_fd = os.open(ENTRIES_DIR, os.O_RDONLY | os.O_DIRECTORY)
+    loader_fd = os.open(LOADER_DIR, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        # Writing an entry is dominated by copying the kernel and initrd to the
+        # ESP, which releases the GIL, so handle the generations in parallel.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(gens)) or 1) as executor:
+            futures = [executor.submit(write_entry, *gen, machine_id, entries_fd) for gen in gens]
+            for future in futures:
+                future.result()
+        for gen in gens:
+            if os.readlink(system_dir(*gen)) == args.default_config:
+                write_loader_conf(*gen, loader_fd)
 
-    # Since fat32 provides little recovery facilities after a crash,
-    # it can leave the system in an unbootable state, when a crash/outage
-    # happens shortly after an update. To decrease the likelihood of this
-    # event sync the efi filesystem after each update.
-    rc = libc.syncfs(os.open("@efiSysMountPoint@", os.O_RDONLY))
-    if rc != 0:
-        print("could not sync @efiSysMountPoint@: {}".format(os.strerror(rc)), file=sys.stderr)
+        try:
+            os.unlink("memtest86.conf", dir_fd=entries_fd)
+        except FileNotFoundError:
+            pass
+        shutil.rmtree("@efiSysMountPoint@/efi/memtest86", ignore_errors=True)
+        if "@memtest86@" != "":
+            mkdir_p("@efiSysMountPoint@/efi/memtest86")
+            with os.scandir("@memtest86@") as it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir():
+                        shutil.copytree(entry.path, os.path.join("@efiSysMountPoint@/efi/memtest86", entry.name))
+                    else:
+                        shutil.copy(entry.path, "@efiSysMountPoint@/efi/memtest86/")
+
+            write_file(entries_fd, "memtest86.conf", MEMTEST_BOOT_ENTRY)
+
+        # The files themselves were synced as they were written, so only
+        # their directories are left.
+        if sync_each_file:
+            os.fdatasync(entries_fd)
+            os.fdatasync(loader_fd)
+            sync_file(NIXOS_DIR)
+        else:
+            rc = libc.syncfs(os.open("@efiSysMountPoint@", os.O_RDONLY))
+            if rc != 0:
+                print("could not sync @efiSysMountPoint@: {}".format(os.strerror(rc)), file=sys.stderr)
+    finally:
+        os.close(loader_fd)
+        os.close(entries_fd)
 
 if __name__ == '__main__':
     main()
@@ -16,8 +16,6 @@ let
 
     systemd = config.systemd.package;
 
-    nix = config.nix.package.out;
-
     timeout = if config.boot.loader.timeout != null then config.boot.loader.timeout else "";
 
     editor = if cfg.editor then "True" else "False";